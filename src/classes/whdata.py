@@ -4,22 +4,28 @@
     - Views, which is as close to the original document as possible
     - Videos, which collapses the views into a count
     - Channels, which collapses the videos into a count
+    The Views can also be rolled up into time buckets (daily, weekly,
+    monthly and a weekday/hour heatmap) and grouped into viewing sessions.
     The DataFrames can then be used by other parts of the program.
 """
 #core
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime
+from io import TextIOWrapper
+from itertools import islice
 import json
 from json import JSONDecodeError
 import logging as log
 from pathlib import Path
 import re
-import warnings
 from zipfile import ZipFile
 #modules
 from dateutil import tz, parser as dateutil_parser
-from htmlement import parse as html_parse
-from pandas import DataFrame, concat, period_range, to_datetime
+from htmlement import ParseHTML
+import numpy as np
+from pandas import DataFrame, Series, factorize, to_datetime
+from pandas.core.dtypes.dtypes import DatetimeTZDtype
 from tzlocal import get_localzone
 
 
@@ -39,7 +45,97 @@ class ViewRecord:
     view: datetime
 
 
-class WatchHistoryDataHandler:
+NS_PER_HOUR = 3_600_000_000_000
+NS_PER_DAY = 24 * NS_PER_HOUR
+#1970-01-01 was a Thursday, shift by 3 days so weeks start on Monday
+EPOCH_WEEKDAY = 3
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+#minutes without a view before the next view starts a new session
+SESSION_IDLE_GAP = 30
+# video_url is more unique than video_id
+# to get the right counts 'music.youtube' needs to be counted separately from 'www.youtube'
+VIDEO_COLUMNS = ['channel_id', 'channel_title', 'channel_url',
+                 'video_id', 'video_title', 'video_url']
+#characters read at a time when streaming the JSON or HTML export
+READ_SIZE = 1 << 18
+
+
+class OuterCellParser(ParseHTML):
+    """
+    Incremental HTML parser for the watch history. Every outer-cell div
+    (one record) is taken out of the tree as soon as it is closed and kept
+    in cells until it is read, so the tree never holds the whole document.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.cells = []
+
+    def handle_endtag(self, tag):
+        open_elems = list(self._elem)
+        super().handle_endtag(tag)
+        for idx in range(len(self._elem), len(open_elems)):
+            elem = open_elems[idx]
+            if elem.tag == 'div' and elem.get('class', '').startswith('outer-cell'):
+                open_elems[idx - 1].remove(elem)
+                self.cells.append(elem)
+
+
+@dataclass
+class SessionViews:
+    """
+    SessionViews are what sessions need from the views: the view times
+    (int64 UTC nanoseconds) and the channel code of every view, with the
+    channel urls (code order) and the title of their first view.
+    """
+    view_times: list
+    channel_codes: list
+    channels: dict
+    channel_titles: list
+
+    def merge(self, other):
+        """Merge other into these SessionViews, returns these SessionViews."""
+        remap = np.empty(len(other.channels), dtype=np.int64)
+        for code, (url, title) in enumerate(zip(other.channels, other.channel_titles)):
+            if url not in self.channels:
+                self.channels[url] = len(self.channels)
+                self.channel_titles.append(title)
+            remap[code] = self.channels[url]
+        self.view_times.extend(other.view_times)
+        self.channel_codes.extend(remap[codes] for codes in other.channel_codes)
+        return self
+
+
+@dataclass
+class ViewCounts:
+    """
+    ViewCounts are the partial counts of a chunk of views, used when the
+    watch history is processed out-of-core. Merging is associative, so
+    chunks can be merged in any grouping and end up with the same counts
+    as processing all of the views at once. Merges are done in place, so
+    merging a chunk only costs the size of the chunk.
+    """
+    views: int
+    #the distinct video rows (VIDEO_COLUMNS tuples), in the order they were first seen
+    videos: dict
+    video_views: Counter
+    day_views: Series
+    heatmap: np.ndarray
+    sessions: SessionViews
+
+    def merge(self, other):
+        """Merge other into these ViewCounts, returns these ViewCounts."""
+        self.views += other.views
+        self.videos.update(dict.fromkeys(other.videos))
+        self.video_views.update(other.video_views)
+        self.day_views = self.day_views.add(other.day_views, fill_value=0).astype(np.int64)
+        self.heatmap = self.heatmap + other.heatmap
+        self.sessions.merge(other.sessions)
+        return self
+
+
+#every DataFrame can be created from all of the views or from merged chunks
+class WatchHistoryDataHandler:  # pylint: disable=too-many-public-methods
     """
     WatchHistoryDataHandler
     """
@@ -49,38 +145,126 @@ class WatchHistoryDataHandler:
         create_views_df_from_source
         """
         views_df = None
-        src = Path(source_file)
 
-        match src.suffix[1:].lower():
-            case 'zip':
-                with ZipFile(src) as azip:
-                    for file in azip.filelist:
-                        found_html = file.filename.endswith('watch-history.html')
-                        found_json = file.filename.endswith('watch-history.json')
-                        if found_html:
-                            with azip.open(file) as doc:
-                                views_df = self.create_views_df_html(doc)
-                        elif found_json:
-                            with azip.open(file) as doc:
-                                try:
-                                    data = json.load(doc)
-                                    views_df = self.create_views_df_json(data)
-                                except JSONDecodeError as jerr:
-                                    log.error("JSON %s", jerr.msg)
-            case 'html':
-                with open(src, 'r', encoding='UTF-8') as doc:
+        for kind, doc in self.iter_source_docs(Path(source_file)):
+            match kind:
+                case 'html':
                     views_df = self.create_views_df_html(doc)
-            case 'json':
-                with open(src, 'r', encoding='UTF-8') as doc:
+                case 'json':
                     try:
                         data = json.load(doc)
                         views_df = self.create_views_df_json(data)
                     except JSONDecodeError as jerr:
                         log.error("JSON %s", jerr.msg)
+
+        return views_df
+
+    def iter_views_dfs_from_source(self, source_file, chunk_size):
+        """
+        Out-of-core version of create_views_df_from_source: yields Views
+        DataFrames of at most chunk_size views, so the whole watch history
+        never has to be a single DataFrame. View times are always UTC.
+        The export is streamed, only the records of the current chunk are
+        in memory. Raises JSONDecodeError for a malformed JSON export.
+        """
+        stats = {'total': 0, 'surveys': 0}
+        view_count = 0
+
+        for kind, doc in self.iter_source_docs(Path(source_file)):
+            records = self.iter_view_records(kind, doc, stats)
+            while chunk := list(islice(records, chunk_size)):
+                views_df = DataFrame(chunk)
+                views_df['view'] = to_datetime(views_df['view'], utc=True)
+                view_count += views_df.shape[0]
+                yield views_df
+
+        if view_count > 0:
+            log.info('%7d total records processed', stats['total'])
+            log.info('%7d ads ignored, %d were surveys',
+                     stats['total'] - view_count, stats['surveys'])
+            log.info('%7d views', view_count)
+
+    @staticmethod
+    def iter_source_docs(src):
+        """
+        Yields the file type ('html' or 'json') and the open text document
+        for the watch history in the source file. For zips, the last watch
+        history file found is used.
+        """
+        match src.suffix[1:].lower():
+            case 'zip':
+                with ZipFile(src) as azip:
+                    found = [file for file in azip.filelist
+                             if file.filename.endswith(('watch-history.html',
+                                                        'watch-history.json'))]
+                    for file in found[-1:]:
+                        with TextIOWrapper(azip.open(file), encoding='UTF-8') as doc:
+                            yield file.filename.rsplit('.', 1)[1], doc
+            case 'html' | 'json':
+                with open(src, 'r', encoding='UTF-8') as doc:
+                    yield src.suffix[1:].lower(), doc
             case _:
                 log.error('Unable to process %s: unrecognized file type', src)
 
-        return views_df
+    @staticmethod
+    def iter_view_records(kind, doc, stats):
+        """
+        Yields the ViewRecords from an open html or json document, streaming it.
+        """
+        match kind:
+            case 'html':
+                yield from WatchHistoryDataHandler.iter_view_records_html(doc, stats)
+            case 'json':
+                yield from WatchHistoryDataHandler.iter_view_records_json(
+                    WatchHistoryDataHandler.iter_json_array(doc), stats)
+
+    @staticmethod
+    def iter_json_array(doc):
+        """
+        Yields the elements of the JSON array in the document one at a time,
+        decoding them from a buffer filled READ_SIZE characters at a time
+        instead of loading the whole document. Raises JSONDecodeError.
+        """
+        decoder = json.JSONDecoder()
+        buffer, pos, eof = '', 0, False
+        #'start' expects '[', 'first' a value or ']', 'value' a value, 'next' ',' or ']'
+        state = 'start'
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos == len(buffer) and not eof:
+                more = doc.read(READ_SIZE)
+                buffer, pos, eof = more, 0, not more
+                continue
+            char = buffer[pos:pos + 1]
+            match state, char:
+                case 'start', '[':
+                    state = 'first'
+                    pos += 1
+                case ('first' | 'next'), ']':
+                    return
+                case 'next', ',':
+                    state = 'value'
+                    pos += 1
+                case ('first' | 'value'), _ if char:
+                    try:
+                        element, end = decoder.raw_decode(buffer, pos)
+                    except JSONDecodeError:
+                        if eof:
+                            raise
+                        end = len(buffer)
+                    if end == len(buffer) and not eof:
+                        #the element may go on in the next read
+                        more = doc.read(READ_SIZE)
+                        buffer, pos, eof = buffer[pos:] + more, 0, not more
+                        continue
+                    yield element
+                    pos = end
+                    state = 'next'
+                case 'next', _:
+                    raise JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                case _:
+                    raise JSONDecodeError('Expecting value', buffer, pos)
 
     @staticmethod
     def create_views_df_json(data):
@@ -88,12 +272,30 @@ class WatchHistoryDataHandler:
         create_views_df_json
         """
         views_df = None
-        total = len(data)
-        views = []
-        data_views = [rec for rec in data if 'subtitles' in rec]
-        survey_count = 0
+        stats = {'total': 0, 'surveys': 0}
+        views = list(WatchHistoryDataHandler.iter_view_records_json(data, stats))
+
+        if len(views) > 0:
+            views_df = DataFrame(views)
+            views_df['view'] = to_datetime(views_df['view'], utc=True)
+
+            log.info('%7d total records processed', stats['total'])
+            log.info('%7d ads ignored, %d were surveys',
+                     stats['total'] - views_df.shape[0], stats['surveys'])
+            log.info('%7d views', views_df.shape[0])
+
+        return views_df
 
-        for rec in data_views:
+    @staticmethod
+    def iter_view_records_json(data, stats):
+        """
+        Yields a ViewRecord for every view in the JSON data (a list or an
+        iterator of records). Counts the records and surveys into stats.
+        """
+        for rec in data:
+            stats['total'] += 1
+            if 'subtitles' not in rec:
+                continue
             channel = rec['subtitles'][0]
             if 'url' in channel:
                 #get ids
@@ -102,7 +304,7 @@ class WatchHistoryDataHandler:
                 vd_url = rec.get('titleUrl')
                 vd_id = vd_url.split("?v=", 1)[1] if '?v=' in vd_url else vd_url
 
-                view_record = ViewRecord(
+                yield ViewRecord(
                     channel_title=channel.get('name'),
                     channel_url=ch_url,
                     channel_id=ch_id,
@@ -111,87 +313,140 @@ class WatchHistoryDataHandler:
                     video_id=vd_id,
                     view=dateutil_parser.isoparse(rec.pop('time'))
                 )
-                views.append(view_record)
             else:
-                survey_count += 1
+                stats['surveys'] += 1
+
+    @staticmethod
+    def create_views_df_html(doc):
+        """
+        create_views_df_html
+        """
+        views_df = None
+        stats = {'total': 0}
+        views = list(WatchHistoryDataHandler.iter_view_records_html(doc, stats))
 
         if len(views) > 0:
             views_df = DataFrame(views)
-            views_df['view'] = to_datetime(views_df['view'], utc=True)
-
-            log.info('%7d total records processed', total)
-            log.info('%7d ads ignored, %d were surveys',
-                     total - views_df.shape[0], survey_count)
+            log.info('%7d total records processed', stats['total'])
+            log.info('%7d ads ignored', stats['total'] - views_df.shape[0])
             log.info('%7d views', views_df.shape[0])
-
         return views_df
 
     @staticmethod
-    def create_views_df_html(doc):
+    def iter_view_records_html(doc, stats):
         """
-        create_views_df_html
+        Yields a ViewRecord for every view in the HTML document.
+        Counts the records into stats. The document is fed to the parser
+        READ_SIZE characters at a time and each record is dropped from the
+        tree once it is read.
         """
         tzinfos = {"EST": tz.gettz('US/Eastern'),
                    "CST": tz.gettz('US/Central'),
                    "MST": tz.gettz('US/Mountain'),
                    "PST": tz.gettz('US/Pacific')}
 
-        views_df = None
-        views = []
-        idx = 0
         last_good_tz = get_localzone()
 
-        for outer_cell in html_parse(doc, encoding="UTF-8").iterfind(".//div[@class]"):
-            if outer_cell.get('class').startswith('outer-cell'):
-                idx += 1
-                div = outer_cell.find('.//div[1]/div[@class][2]')
-                channel_alink = div.find(".//a[2]")
-                if channel_alink is not None:
-                    #now process the video view
-                    video_alink = div.find(".//a[1]")
-                    vw_date = div.find(".//br[2]").tail.replace('\u202f', ' ')
-                    view_date = re.search('.*[AP]M', vw_date).group(0)
-                    view_date = dateutil_parser.parse(view_date)
-                    vw_tz = vw_date.rsplit(' ', 1)[1]
-                    if vw_tz is not None and vw_tz in tzinfos:
-                        last_good_tz = tzinfos[vw_tz]
-                    view_date = view_date.replace(tzinfo=last_good_tz)
-                    #get ids
-                    ch_url = channel_alink.get('href')
-                    ch_id = ch_url.split("/channel/", 1)[1] if "/channel/" in ch_url else ch_url
-                    vd_url = video_alink.get('href')
-                    vd_id = vd_url.split("?v=", 1)[1] if '?v=' in vd_url else vd_url
-
-                    view_record = ViewRecord(
-                        channel_title=channel_alink.text,
-                        channel_url=ch_url,
-                        channel_id=ch_id,
-                        video_title=video_alink.text,
-                        video_url=vd_url,
-                        video_id=vd_id,
-                        view=view_date
-                    )
-                    views.append(view_record)
+        for outer_cell in WatchHistoryDataHandler.iter_outer_cells(doc):
+            stats['total'] += 1
+            div = outer_cell.find('.//div[1]/div[@class][2]')
+            channel_alink = div.find(".//a[2]")
+            if channel_alink is not None:
+                #now process the video view
+                video_alink = div.find(".//a[1]")
+                vw_date = div.find(".//br[2]").tail.replace('\u202f', ' ')
+                view_date = re.search('.*[AP]M', vw_date).group(0)
+                view_date = dateutil_parser.parse(view_date)
+                vw_tz = vw_date.rsplit(' ', 1)[1]
+                if vw_tz is not None and vw_tz in tzinfos:
+                    last_good_tz = tzinfos[vw_tz]
+                view_date = view_date.replace(tzinfo=last_good_tz)
+                #get ids
+                ch_url = channel_alink.get('href')
+                ch_id = ch_url.split("/channel/", 1)[1] if "/channel/" in ch_url else ch_url
+                vd_url = video_alink.get('href')
+                vd_id = vd_url.split("?v=", 1)[1] if '?v=' in vd_url else vd_url
 
-        if len(views) > 0:
-            views_df = DataFrame(views)
-            log.info('%7d total records processed', idx)
-            log.info('%7d ads ignored', idx - views_df.shape[0])
-            log.info('%7d views', views_df.shape[0])
-        return views_df
+                yield ViewRecord(
+                    channel_title=channel_alink.text,
+                    channel_url=ch_url,
+                    channel_id=ch_id,
+                    video_title=video_alink.text,
+                    video_url=vd_url,
+                    video_id=vd_id,
+                    view=view_date
+                )
+
+    @staticmethod
+    def iter_outer_cells(doc):
+        """
+        Yields the outer-cell divs (one per record) of the HTML document as
+        soon as they are parsed, in document order.
+        """
+        parser = OuterCellParser()
+        rest = ''
+        while block := doc.read(READ_SIZE):
+            #feed up to the last tag, text split over two feeds can lose its whitespace
+            block = rest + block
+            cut = block.rfind('<')
+            if cut <= 0:
+                rest = block
+                continue
+            parser.feed(block[:cut])
+            rest = block[cut:]
+            yield from parser.cells
+            parser.cells.clear()
+        parser.feed(rest)
+        #records that were never closed are still in the tree
+        root = parser.close()
+        yield from parser.cells
+        for div in root.iterfind(".//div[@class]"):
+            if div.get('class').startswith('outer-cell'):
+                yield div
 
     def create_videos_df(self, views_df):
         """
         Create Videos DataFrame from Views DataFrame.
         """
-        # video_url is more unique than video_id
-        # to get the right counts 'music.youtube' needs to be counted separately from 'www.youtube'
-        videos_df = self.create_count_df(
-            views_df, ['channel_id', 'channel_title', 'channel_url',
-                       'video_id', 'video_title', 'video_url'],
-            'video_url', 'views')
+        videos_df = self.create_count_df(views_df, VIDEO_COLUMNS, 'video_url', 'views')
         return videos_df
 
+    @staticmethod
+    def create_view_counts(views_df):
+        """
+        Create the partial ViewCounts for a chunk of the Views DataFrame.
+        """
+        days, hours = WatchHistoryDataHandler.bucket_views(views_df)
+        return ViewCounts(
+            views=views_df.shape[0],
+            videos=dict.fromkeys(zip(*(views_df[col] for col in VIDEO_COLUMNS))),
+            video_views=Counter(views_df['video_url'].value_counts().to_dict()),
+            day_views=Series(days).value_counts(),
+            heatmap=WatchHistoryDataHandler.count_heatmap(days, hours),
+            sessions=WatchHistoryDataHandler.create_session_views(views_df))
+
+    @staticmethod
+    def create_videos_df_from_counts(counts):
+        """
+        Create Videos DataFrame from merged ViewCounts,
+        the same as create_videos_df on all of the views.
+        """
+        videos_df = DataFrame(list(counts.videos), columns=VIDEO_COLUMNS)
+        video_views = Series(counts.video_views, dtype=np.int64)
+        videos_df.loc[:, 'views'] = videos_df.loc[:, 'video_url'].map(video_views)
+        videos_df = videos_df.sort_values(by='views', ascending=False)
+        return videos_df
+
+    @staticmethod
+    def create_rollup_dfs_from_counts(counts):
+        """
+        Create the time rollup DataFrames from merged ViewCounts,
+        the same as create_rollup_dfs on all of the views.
+        """
+        return WatchHistoryDataHandler.create_rollup_dfs_from_buckets(
+            counts.day_views.index.to_numpy(np.int64), counts.heatmap,
+            counts.day_views.to_numpy())
+
     def create_channels_df(self, videos_df):
         """
         Create Channels DataFrame from Videos DataFrame.
@@ -202,32 +457,186 @@ class WatchHistoryDataHandler:
         return channels_df
 
     @staticmethod
-    def create_monthlyviews_df(views_df):
-        """
-        Create Monthly Views DataFrame from Views DataFrame.
-        """
-        #2024-04: the pandas team is still in discussions on how to make periods timezone aware
-        #Ignore specific UserWarning message, our data/graph gives the general idea to the user
-        warn = 'Converting to PeriodArray/Index representation will drop timezone information.'
-        warnings.filterwarnings('ignore', message=warn, )
-
-        #set up the monthly slots (mdf)
-        idx = period_range(views_df['view'].min(), views_df['view'].max(), freq='M')
-        mdf = DataFrame(idx.to_timestamp(), columns=['view'])
-        mdf['count'] = 0
-        #collapse the views data into counts
-        vdf = DataFrame(views_df['view'].dt.to_period("M").dt.to_timestamp(), columns=['view'])
-        vdf['count'] = vdf['view'].map(
-            views_df['view'].dt.to_period("M").dt.to_timestamp().value_counts())
-        #merge the monthly slots and view data counts, keep the highest values
-        monthlyviews_df = concat([vdf, mdf], axis=0).sort_values(['view', 'count'])
-        monthlyviews_df = monthlyviews_df.drop_duplicates(
-            subset='view', keep='last').reset_index(drop=True)
-        monthlyviews_df = monthlyviews_df.rename(columns={'view': 'month'})
-        #Reset warnings to defaults
-        warnings.resetwarnings()
-
-        return monthlyviews_df
+    def create_rollup_dfs(views_df):
+        """
+        Create the time rollup DataFrames from the Views DataFrame in one pass.
+        The views are converted to local time once and bucketed into
+        integer days/hours, every rollup is then a bincount of those buckets:
+        - daily, weekly (starting Monday) and monthly view counts
+        - heatmap, a weekday by hour of day count of views
+        """
+        days, hours = WatchHistoryDataHandler.bucket_views(views_df)
+        return WatchHistoryDataHandler.create_rollup_dfs_from_buckets(
+            days, WatchHistoryDataHandler.count_heatmap(days, hours))
+
+    @staticmethod
+    def create_rollup_dfs_from_buckets(days, heatmap, day_views=None):
+        """
+        Create the time rollup DataFrames from day buckets and heatmap counts.
+        day_views are the number of views per day bucket, when the days
+        are already counted (see ViewCounts), otherwise each day is one view.
+        """
+        bucket_count = WatchHistoryDataHandler.create_bucket_count_df
+        weeks = (days + EPOCH_WEEKDAY) // 7
+
+        daily_df = bucket_count(days, 'day', 'datetime64[D]', weights=day_views)
+        weekly_df = bucket_count(weeks, 'week', 'datetime64[D]',
+                                 lambda wk: wk * 7 - EPOCH_WEEKDAY, day_views)
+        monthly_df = bucket_count(WatchHistoryDataHandler.month_buckets(days),
+                                  'month', 'datetime64[M]', weights=day_views)
+
+        #weekday (rows) by hour of day (columns)
+        heatmap_df = DataFrame(heatmap, columns=[f'{hour:02d}' for hour in range(24)])
+        heatmap_df.insert(0, 'weekday', WEEKDAYS)
+
+        return {
+            'daily_df': daily_df,
+            'weekly_df': weekly_df,
+            'monthly_df': monthly_df,
+            'heatmap_df': heatmap_df
+        }
+
+    @staticmethod
+    def bucket_views(views_df):
+        """
+        Convert the view column to local wall-clock time once, then split it
+        into integer buckets: days since the epoch and the hour of the day.
+        """
+        views = views_df['view']
+        if not isinstance(views.dtype, DatetimeTZDtype):
+            #mixed timezones come through as objects, normalize them
+            views = to_datetime(views, utc=True)
+        local = views.dt.tz_convert(get_localzone()).dt.tz_localize(None)
+        nanos = local.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        days = nanos // NS_PER_DAY
+        hours = (nanos // NS_PER_HOUR) % 24
+        return days, hours
+
+    @staticmethod
+    def count_heatmap(days, hours):
+        """Count views into a weekday (Monday first) by hour of day array."""
+        weekdays = (days + EPOCH_WEEKDAY) % 7
+        return np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+
+    @staticmethod
+    def month_buckets(days):
+        """Turn days since the epoch into months since the epoch."""
+        return days.astype('datetime64[D]').astype('datetime64[M]').view(np.int64)
+
+    @staticmethod
+    def create_bucket_count_df(buckets, label, unit, to_unit=None, weights=None):
+        """
+        Count integer buckets into a DataFrame with a label and count column.
+        Every bucket between the first and last one gets a row, so gaps
+        show up as zero counts. to_unit converts bucket numbers into the
+        numpy datetime unit used for the label, when they differ.
+        weights are the counts of already counted buckets.
+        """
+        first = buckets.min()
+        counts = np.bincount(buckets - first, weights=weights).astype(np.int64)
+        slots = np.arange(first, first + counts.shape[0])
+        if to_unit is not None:
+            slots = to_unit(slots)
+        labels = slots.astype(unit).astype('datetime64[ns]')
+        return DataFrame({label: labels, 'count': counts})
+
+    @staticmethod
+    def create_sessions_df(views_df, idle_gap=SESSION_IDLE_GAP):
+        """
+        Create Sessions DataFrame from Views DataFrame.
+        Views are sorted by time, and a gap of more than idle_gap minutes
+        between two views starts a new session. Each session gets its
+        start, end, length in minutes, view count and the channel watched
+        the most during it. The longest binges (most views) come first.
+        Views have no duration, so a session's end is when its last view
+        started and the length of a single view session is 0.
+        """
+        return WatchHistoryDataHandler.create_sessions_df_from_views(
+            WatchHistoryDataHandler.create_session_views(views_df), idle_gap)
+
+    @staticmethod
+    def create_session_views(views_df):
+        """
+        Create the SessionViews for the Views DataFrame (or a chunk of it).
+        """
+        views = views_df['view']
+        if not isinstance(views.dtype, DatetimeTZDtype):
+            #mixed timezones come through as objects, normalize them
+            views = to_datetime(views, utc=True)
+        nanos = views.dt.tz_convert('UTC').to_numpy(dtype='datetime64[ns]').view(np.int64)
+        #work with channel codes instead of strings, look the strings up at the end
+        codes, channel_urls = factorize(views_df['channel_url'])
+        #title from the first view of each channel
+        channel_titles = views_df['channel_title'].to_numpy()[
+            WatchHistoryDataHandler.first_by_code(codes, channel_urls.shape[0])]
+        return SessionViews(
+            view_times=[nanos],
+            channel_codes=[codes],
+            channels={url: code for code, url in enumerate(channel_urls)},
+            channel_titles=list(channel_titles))
+
+    @staticmethod
+    def create_sessions_df_from_views(session_views, idle_gap=SESSION_IDLE_GAP):
+        """
+        Create Sessions DataFrame from (merged) SessionViews,
+        the same as create_sessions_df on all of the views.
+        """
+        nanos = np.concatenate(session_views.view_times)
+        codes = np.concatenate(session_views.channel_codes)
+        channel_urls = np.array(list(session_views.channels), dtype=object)
+        channel_titles = np.array(session_views.channel_titles, dtype=object)
+        order = np.argsort(nanos, kind='stable')
+        nanos = nanos[order]
+
+        #a new session starts after every gap larger than idle_gap
+        is_start = np.concatenate(([True], np.diff(nanos) > int(idle_gap * 60 * 1_000_000_000)))
+        session = np.cumsum(is_start) - 1
+        #the views are sorted, so sessions are contiguous runs of views
+        starts = np.flatnonzero(is_start)
+        ends = np.concatenate((starts[1:], [nanos.shape[0]])) - 1
+
+        sessions_df = DataFrame({
+            'session': np.arange(starts.shape[0]),
+            'start': to_datetime(nanos[starts], unit='ns', utc=True),
+            'end': to_datetime(nanos[ends], unit='ns', utc=True),
+            'minutes': ((nanos[ends] - nanos[starts]) / (60 * 1_000_000_000)).round(1),
+            'views': ends - starts + 1})
+
+        top_channel, channel_views = WatchHistoryDataHandler.top_session_channels(
+            session, codes[order], channel_urls.shape[0])
+        sessions_df['channel_title'] = channel_titles[top_channel]
+        sessions_df['channel_url'] = channel_urls[top_channel]
+        sessions_df['channel_views'] = channel_views
+
+        sessions_df = sessions_df.sort_values(['views', 'minutes'], ascending=False)
+        sessions_df = sessions_df.reset_index(drop=True)
+        return sessions_df
+
+    @staticmethod
+    def first_by_code(codes, code_count):
+        """The index of the first occurrence of every code (reversed so the first wins)."""
+        first = np.empty(code_count, dtype=np.int64)
+        first[codes[::-1]] = np.arange(codes.shape[0])[::-1]
+        return first
+
+    @staticmethod
+    def top_session_channels(session, codes, channel_count):
+        """
+        The top channel per session: count every (session, channel code) pair,
+        then keep the first pair per session with the session's highest count.
+        Returns the top channel code and its view count for every session.
+        """
+        pairs = np.sort(session * channel_count + codes)
+        pair_starts = np.flatnonzero(np.concatenate(([True], pairs[1:] != pairs[:-1])))
+        pair_counts = np.diff(np.concatenate((pair_starts, [pairs.shape[0]])))
+        pair_keys = pairs[pair_starts]
+        pair_session = pair_keys // channel_count
+        session_firsts = np.flatnonzero(np.concatenate(
+            ([True], pair_session[1:] != pair_session[:-1])))
+        session_max = np.maximum.reduceat(pair_counts, session_firsts)
+        top = np.flatnonzero(pair_counts == session_max[pair_session])
+        top = top[np.concatenate(([True], pair_session[top[1:]] != pair_session[top[:-1]]))]
+        return pair_keys[top] % channel_count, pair_counts[top]
 
     @staticmethod
     def create_count_df(a_df, cols, key, count_name):
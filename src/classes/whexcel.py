@@ -1,8 +1,10 @@
 """excelbuilder"""
 #core
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import partial
 import logging as log
 import os
+import time
 #modules
 from numpy.dtypes import DateTime64DType
 from pandas import DataFrame, ExcelWriter, Timestamp
@@ -10,6 +12,35 @@ from pandas.core.dtypes.dtypes import DatetimeTZDtype
 from tzlocal import get_localzone
 from xlsxwriter import __name__ as XLSXWRITER
 from xlsxwriter.utility import xl_col_to_name
+#classes
+from classes.whdata import VIDEO_COLUMNS
+
+#keep charts for long histories (e.g. daily views) from getting too wide to use
+MAX_CHART_WIDTH = 4000
+#Excel allows 65,530 hyperlinks per worksheet, xlsxwriter drops (and warns about) the rest
+HYPERLINK_LIMIT = 65530
+#what to write once a sheet's hyperlinks run out: the title as plain text with the
+#url in a separate column, or HYPERLINK() formulas (clickable, but slower to write)
+LINK_OVERFLOWS = ('text', 'formula')
+#longest string Excel allows in a formula argument
+FORMULA_STRING_LIMIT = 255
+#column widths of every sheet
+SHEET_WIDTHS = {
+    'Channels': [45, 6],
+    'Videos': [45, 45, 6],
+    'Views': [45, 19],
+    'Daily': [11, 6],
+    'Weekly': [11, 6],
+    'Monthly': [8, 6],
+    'Heatmap': [11] + [4] * 24,
+    'Sessions': [8, 19, 19, 8, 6, 45, 8]
+}
+#the compact Videos sheet has a Video Key column and the Views sheet only the key
+COMPACT_SHEET_WIDTHS = {**SHEET_WIDTHS, 'Videos': [45, 45, 8, 6], 'Views': [8, 19]}
+#bytes xlsxwriter keeps for every hyperlink until the workbook is closed (about 700 measured)
+LINK_MEMORY = 1024
+#sheets with hyperlinks: Channels, Videos, Views and Sessions
+LINK_SHEETS = 4
 
 
 @dataclass
@@ -19,9 +50,50 @@ class Hyperlink:
     url: str = None
 
 
+@dataclass
+class HyperlinkBudget:
+    """
+    HyperlinkBudget tracks how many real hyperlinks are left to write on a
+    sheet, and how to write the links that go over the budget.
+    """
+    remaining: int
+    overflow: str
+    url_format: object = None
+    url_columns: bool = False
+    #links written as plain titles because the url is too long for a formula
+    dropped: int = 0
+
+
+@dataclass
+class WorkbookExport:
+    """
+    WorkbookExport is what the sheets of one export_spreadsheet share:
+    the workbook, its cell formats (from add_formats) and the
+    HyperlinkBudget of every sheet.
+    """
+    book: object
+    formats: dict
+    link_budgets: dict = field(default_factory=dict)
+
+
 class ExcelBuilder:
     """ExcelBuilder"""
 
+    def __init__(self, link_overflow='text', link_budget=HYPERLINK_LIMIT, compact=False):
+        if link_budget < 1:
+            raise ValueError(f'link_budget must be greater than 0, not {link_budget}')
+        if link_overflow not in LINK_OVERFLOWS:
+            raise ValueError(f'link_overflow must be one of {LINK_OVERFLOWS}, '
+                             f'not {link_overflow!r}')
+        self.link_overflow = link_overflow
+        self.link_budget = min(link_budget, HYPERLINK_LIMIT)
+        #compact: the Views sheet references Videos rows instead of repeating titles and urls
+        self.compact = compact
+
+    def limit_link_memory(self, max_bytes):
+        """Lowers the link budget so the hyperlinks of every sheet fit in max_bytes."""
+        self.link_budget = max(1, min(self.link_budget, max_bytes // (LINK_MEMORY * LINK_SHEETS)))
+
     def clean_data_for_report(self, channels_df, videos_df, views_df):
         """
         Cleans the DataFrames for the report by creating new focused DataFrames.
@@ -29,17 +101,64 @@ class ExcelBuilder:
         This also turns title/url columns into Hyperlink columns for rendering.
         """
         ch_df = DataFrame(channels_df, columns=['channel_title', 'channel_url', 'videos'])
-        vd_df = DataFrame(videos_df,
-                          columns=['channel_title', 'channel_url', 'video_title', 'video_url', 'views'])
-        vw_df = DataFrame(views_df, columns=['video_title', 'video_url', 'view'])
+        vd_cols = ['channel_title', 'channel_url', 'video_title', 'video_url', 'views']
+        if self.compact:
+            #the video key is what the compact Views sheet references
+            vd_cols.insert(4, 'video_key')
+        vd_df = DataFrame(videos_df, columns=vd_cols)
 
         #turn title/url columns into hyperlinks for rendering
         ch_df = self.create_hyperlink(ch_df, 'Channel', 'channel_title', 'channel_url')
         vd_df = self.create_hyperlink(vd_df, 'Channel', 'channel_title', 'channel_url')
         vd_df = self.create_hyperlink(vd_df, 'Video', 'video_title', 'video_url')
-        vw_df = self.create_hyperlink(vw_df, 'Video', 'video_title', 'video_url')
+        vw_df = self.clean_views_for_report(views_df, videos_df)
         return ch_df, vd_df, vw_df
 
+    def get_views_columns(self):
+        """
+        The Views DataFrame columns the Views sheet is made from, compact
+        needs every video column to find the view's Videos row.
+        """
+        if self.compact:
+            return VIDEO_COLUMNS + ['view']
+        return ['video_title', 'video_url', 'view']
+
+    def clean_views_for_report(self, views_df, videos_df=None):
+        """
+        Cleans the Views DataFrame (or a chunk of it) for the report,
+        turning the video title/url columns into a Hyperlink column.
+        When compact, only the video key of the view's Videos row is kept
+        (the Videos DataFrame needs a video_key column, see add_video_keys).
+        """
+        if self.compact:
+            keys = DataFrame(videos_df, columns=VIDEO_COLUMNS + ['video_key'])
+            vw_df = DataFrame(views_df, columns=self.get_views_columns())
+            vw_df = vw_df.merge(keys, on=VIDEO_COLUMNS, how='left')
+            vw_df = DataFrame(vw_df, columns=['video_key', 'view'])
+        else:
+            vw_df = DataFrame(views_df, columns=self.get_views_columns())
+            vw_df = self.create_hyperlink(vw_df, 'Video', 'video_title', 'video_url')
+        return vw_df
+
+    def clean_sessions_for_report(self, sessions_df):
+        """
+        Cleans the Sessions DataFrame for the report, turning the top channel
+        title/url columns into a Hyperlink column for rendering.
+        """
+        ss_df = DataFrame(sessions_df, columns=['session', 'start', 'end', 'minutes', 'views',
+                                                'channel_title', 'channel_url', 'channel_views'])
+        ss_df = self.create_hyperlink(ss_df, 'Top Channel', 'channel_title', 'channel_url')
+        return ss_df
+
+    @staticmethod
+    def add_video_keys(videos_df):
+        """
+        Numbers the Videos rows with a video_key, the same video can have more
+        than one row (www and music urls, renamed titles or channels),
+        so the video id is not enough to find its row.
+        """
+        return videos_df.assign(video_key=range(1, videos_df.shape[0] + 1))
+
     @staticmethod
     def create_hyperlink(a_df, col_label, title_col, url_col):
         """
@@ -50,34 +169,76 @@ class ExcelBuilder:
         if title_col in a_df.columns and url_col in a_df.columns:
             idx = a_df.columns.get_loc(title_col)
             a_df.insert(idx, col_label,
-                        a_df.apply(lambda row: Hyperlink(row[title_col], row[url_col]),
-                                   axis=1))
+                        [Hyperlink(title, url)
+                         for title, url in zip(a_df[title_col], a_df[url_col])])
             a_df.drop(columns=[title_col, url_col], inplace=True)
         return a_df
 
     def export_spreadsheet(self, filename, dfs):
-        """export_spreadsheet"""
+        """
+        export_spreadsheet
+        When the views come as 'views_chunks' (out-of-core mode) instead of a
+        'views_df', the Views sheet is written one chunk at a time and the
+        workbook is written in constant memory mode: every row goes to disk
+        as soon as it is written, so no sheet is held in memory. The
+        trade-off is that strings are written inline instead of in the shared
+        strings table, repeated titles are not deduplicated and the file is
+        bigger (use compact to keep the Views titles out of it).
+        """
+        start = time.perf_counter()
+        videos_df = dfs['videos_df']
+        if self.compact:
+            videos_df = self.add_video_keys(videos_df)
         ch_df, vd_df, vw_df = self.clean_data_for_report(
-            dfs['channels_df'], dfs['videos_df'], dfs['views_df'])
-        mv_df = dfs['monthlyviews_df']
-        channel_widths = [45, 6]
-        video_widths = [45, 45, 6]
-        views_widths = [45, 19]
-        mviews_widths = [8, 6]
-        with ExcelWriter(f"{filename}", engine=XLSXWRITER) as writer:  # pylint: disable=abstract-class-instantiated
-            self.export_sheet(writer.book, 'Channels', channel_widths, ch_df)
-            self.export_sheet(writer.book, 'Videos', video_widths, vd_df)
-            self.export_sheet(writer.book, 'Views', views_widths, vw_df)
-            self.export_sheet(writer.book, "Monthly", mviews_widths, mv_df)
-            self.add_graph(writer.book, "Monthly", mv_df)
-            home = os.path.expanduser('~')
-            log.info('Exported %s', str(filename).replace(home, "~"))
+            dfs['channels_df'], videos_df, dfs.get('views_df'))
+        views_chunks = dfs.get('views_chunks')
+        #out-of-core, the rows go straight to disk (constant_memory) to keep memory bounded,
+        #urls are only written as Hyperlinks, keep plain url strings from using up the budget
+        options = {'constant_memory': views_chunks is not None, 'strings_to_urls': False}
+        widths = COMPACT_SHEET_WIDTHS if self.compact else SHEET_WIDTHS
+        with ExcelWriter(f"{filename}", engine=XLSXWRITER,  # pylint: disable=abstract-class-instantiated
+                         engine_kwargs={'options': options}) as writer:
+            export = WorkbookExport(writer.book, self.add_formats(writer.book))
+            self.export_sheet(export, 'Channels', widths['Channels'], ch_df)
+            self.export_sheet(export, 'Videos', widths['Videos'], vd_df)
+            if views_chunks is not None:
+                self.export_sheet_chunks(export, 'Views', widths['Views'],
+                                         (self.clean_views_for_report(vw, videos_df)
+                                          for vw in views_chunks), dfs.get('views_count'))
+            else:
+                self.export_sheet(export, 'Views', widths['Views'], vw_df)
+            if dfs.get('daily_df') is not None:
+                self.export_sheet(export, 'Daily', widths['Daily'], dfs['daily_df'])
+                self.add_graph(writer.book, 'Daily', dfs['daily_df'],
+                               {'title': 'Views per Day', 'x_axis': 'Day',
+                                'num_format': 'yyyy-MM-dd', 'type': 'line'})
+            if dfs.get('weekly_df') is not None:
+                self.export_sheet(export, 'Weekly', widths['Weekly'], dfs['weekly_df'])
+                self.add_graph(writer.book, 'Weekly', dfs['weekly_df'],
+                               {'title': 'Views per Week', 'x_axis': 'Week',
+                                'num_format': 'yyyy-MM-dd'})
+            self.export_sheet(export, 'Monthly', widths['Monthly'], dfs['monthlyviews_df'])
+            self.add_graph(writer.book, 'Monthly', dfs['monthlyviews_df'])
+            if dfs.get('heatmap_df') is not None:
+                self.export_sheet(export, 'Heatmap', widths['Heatmap'], dfs['heatmap_df'])
+                self.add_heatmap(writer.book, 'Heatmap', dfs['heatmap_df'])
+            if dfs.get('sessions_df') is not None:
+                ss_df = self.clean_sessions_for_report(dfs['sessions_df'])
+                self.export_sheet(export, 'Sessions', widths['Sessions'], ss_df)
+        self.log_dropped_links(export.link_budgets)
+        home = os.path.expanduser('~')
+        log.info('Exported %s (%.1f MB in %.1f seconds)', str(filename).replace(home, "~"),
+                 os.path.getsize(filename) / 2**20, time.perf_counter() - start)
 
     @staticmethod
-    def add_graph(book, sheet_name, a_df):
+    def add_graph(book, sheet_name, a_df, labels=None):
         """
         Adds a graph to a sheet.
+        The labels can override the chart 'title', 'x_axis' name,
+        the x axis 'num_format' and the chart 'type'.
         """
+        labels = {'title': 'Views per Month', 'x_axis': 'Month',
+                  'num_format': 'yyyy-MM', 'type': 'column', **(labels or {})}
         #get sheet by sheet_name
         if sheet_name in book.sheetnames:
             sheet = book.get_worksheet_by_name(sheet_name)
@@ -85,12 +246,13 @@ class ExcelBuilder:
             sheet = book.add_worksheet(sheet_name)
         sheet.active = True
 
-        #chart - need to be able to pass in labels later
-        chart = book.add_chart({'type': 'column'})
-        chart.set_title({'name': 'Views per Month'})
-        chart.set_x_axis({'name': 'Month', 'num_format': 'yyyy-MM', 'date_axis': False})
+        #chart
+        chart = book.add_chart({'type': labels['type']})
+        chart.set_title({'name': labels['title']})
+        chart.set_x_axis({'name': labels['x_axis'], 'num_format': labels['num_format'],
+                          'date_axis': False})
         chart.set_y_axis({'name': 'Count', 'major_unit': 1})
-        chart.set_size({'width': (10 * a_df.shape[0])})
+        chart.set_size({'width': min(10 * a_df.shape[0], MAX_CHART_WIDTH)})
         v = xl_col_to_name(1)  #B
         c = xl_col_to_name(0)  #A
         chart.add_series({'values': f'=\'{sheet_name}\'!${v}$2:${v}${a_df.shape[0] + 1}',
@@ -100,13 +262,27 @@ class ExcelBuilder:
                           'border': {'color': 'black'}})
         sheet.insert_chart(f'{xl_col_to_name(a_df.shape[1] + 1)}1', chart)
 
-    def export_sheet(self, book, sheet_name, widths, a_df):
-        """export_sheet"""
+    @staticmethod
+    def add_heatmap(book, sheet_name, a_df):
+        """
+        Colors the counts on a sheet (everything right of the first column)
+        with a color scale so it reads as a heatmap.
+        """
+        sheet = book.get_worksheet_by_name(sheet_name)
+        sheet.conditional_format(1, 1, a_df.shape[0], a_df.shape[1] - 1,
+                                 {'type': '2_color_scale',
+                                  'min_color': '#FFFFFF', 'max_color': '#FF0000'})
+
+    def export_sheet(self, export, sheet_name, widths, a_df, total_rows=None):
+        """
+        export_sheet
+        export is the WorkbookExport the sheet is added to.
+        total_rows is the number of rows the sheet will end up with,
+        when a_df is only the first chunk of them.
+        """
+        book, formats = export.book, export.formats
         #book settings
         book.remove_timezone = True
-        bolded = book.add_format({"bold": True})
-        vw_fmt = book.add_format({'num_format': 'yyyy-MM-dd hh:mm AM/PM'})
-        mo_fmt = book.add_format({'num_format': 'yyyy-MM'})
 
         #get sheet by sheet_name
         if sheet_name in book.sheetnames:
@@ -115,9 +291,13 @@ class ExcelBuilder:
             sheet = book.add_worksheet(sheet_name)
         sheet.active = True
 
+        #hyperlinks: decide up front if the sheet fits in the hyperlink budget
+        a_df, widths = self.plan_hyperlinks(export, sheet_name, widths, a_df, total_rows)
+
         #sheet settings
-        sheet.set_row(0, None, bolded)
-        sheet.add_write_handler(Hyperlink, self.write_hyperlink)
+        sheet.set_row(0, None, formats['bold'])
+        sheet.add_write_handler(Hyperlink,
+                                partial(self.write_hyperlink, export.link_budgets[sheet_name]))
         sheet.add_write_handler(Timestamp, self.write_local_datetime)
         for idx, col in enumerate(a_df.columns):
             width = 12
@@ -125,9 +305,11 @@ class ExcelBuilder:
                 width = widths[idx]
 
             if isinstance(a_df.dtypes[col], (DatetimeTZDtype, DateTime64DType)):
-                fmt = vw_fmt
+                fmt = formats['view']
                 if col == 'month':
-                    fmt = mo_fmt
+                    fmt = formats['month']
+                elif col in ('day', 'week'):
+                    fmt = formats['day']
                 sheet.set_column(idx, idx, width, fmt)
             else:
                 sheet.set_column(idx, idx, width)
@@ -136,13 +318,115 @@ class ExcelBuilder:
         sheet.write_row(0, 0, [c.replace('_', ' ').title() for c in a_df.columns])
 
         #data rows
+        self.write_rows(sheet, a_df, 1)
+
+    @staticmethod
+    def add_formats(book):
+        """Adds the cell formats to the workbook, once, to be shared by every sheet."""
+        return {
+            'bold': book.add_format({"bold": True}),
+            'view': book.add_format({'num_format': 'yyyy-MM-dd hh:mm AM/PM'}),
+            'month': book.add_format({'num_format': 'yyyy-MM'}),
+            'day': book.add_format({'num_format': 'yyyy-MM-dd'})
+        }
+
+    def export_sheet_chunks(self, export, sheet_name, widths, chunks, total_rows=None):
+        """
+        Export a sheet from DataFrame chunks, the first chunk sets up the sheet
+        and the rest of the chunks are appended below it.
+        """
+        row = 1
+        for a_df in chunks:
+            if row == 1:
+                self.export_sheet(export, sheet_name, widths, a_df, total_rows)
+            else:
+                if export.link_budgets[sheet_name].url_columns:
+                    a_df = self.add_url_columns(a_df)
+                self.write_rows(export.book.get_worksheet_by_name(sheet_name), a_df, row)
+            row += a_df.shape[0]
+
+    def plan_hyperlinks(self, export, sheet_name, widths, a_df, total_rows=None):
+        """
+        Sets up the sheet's HyperlinkBudget in the WorkbookExport. When the
+        sheet has more hyperlinks than the budget, the links after the budget
+        is used up are written as the link_overflow: 'text' or 'formula'.
+        For 'text' a url column is added after every Hyperlink column.
+        Returns the DataFrame and widths to write.
+        """
+        budget = HyperlinkBudget(self.link_budget, self.link_overflow,
+                                 export.book.get_default_url_format())
+        link_cols = self.get_hyperlink_columns(a_df)
+        link_count = len(link_cols) * (total_rows or a_df.shape[0])
+        if link_count > self.link_budget:
+            log.info('%s has %d links, links after the first %d are written as %s',
+                     sheet_name, link_count, self.link_budget, self.link_overflow)
+            if self.link_overflow == 'text':
+                budget.url_columns = True
+                url_widths = []
+                for idx, col in enumerate(a_df.columns):
+                    url_widths.append(widths[idx] if len(widths) > idx else 12)
+                    if col in link_cols:
+                        url_widths.append(45)
+                widths = url_widths
+                a_df = self.add_url_columns(a_df)
+        export.link_budgets[sheet_name] = budget
+        return a_df, widths
+
+    @staticmethod
+    def log_dropped_links(link_budgets):
+        """Warn about links that could only be written as their title."""
+        for sheet_name, budget in link_budgets.items():
+            if budget.dropped:
+                log.warning('%s has %d links with urls longer than %d characters, '
+                            'they are written as titles without the url',
+                            sheet_name, budget.dropped, FORMULA_STRING_LIMIT)
+
+    @staticmethod
+    def get_hyperlink_columns(a_df):
+        """The columns of the DataFrame that hold Hyperlinks."""
+        cols = []
+        if a_df.shape[0] > 0:
+            cols = [col for col in a_df.columns if isinstance(a_df[col].iloc[0], Hyperlink)]
+        return cols
+
+    def add_url_columns(self, a_df):
+        """Adds a '<column> url' column with the plain url after every Hyperlink column."""
+        a_df = a_df.copy()
+        for col in self.get_hyperlink_columns(a_df):
+            a_df.insert(a_df.columns.get_loc(col) + 1, f'{col} url',
+                        [link.url for link in a_df[col]])
+        return a_df
+
+    @staticmethod
+    def write_rows(sheet, a_df, start_row):
+        """Write the DataFrame rows to the sheet, starting at start_row."""
         for idx, row_data in enumerate(a_df.itertuples(index=False)):
-            sheet.write_row(idx + 1, 0, row_data, None)
+            sheet.write_row(start_row + idx, 0, row_data, None)
 
     @staticmethod
-    def write_hyperlink(worksheet, row, col, link: Hyperlink, _):
-        """write_xlsx_hyperlink"""
-        return worksheet.write_url(row, col, url=link.url, string=link.title)
+    def write_hyperlink(budget, worksheet, row, col, link: Hyperlink, _):
+        """
+        write_xlsx_hyperlink
+        Writes real hyperlinks while the sheet's HyperlinkBudget lasts,
+        then a HYPERLINK() formula or the plain title.
+        The budget is bound with partial when the write handler is added.
+        Formula titles are cut to fit Excel's formula string limit, urls can't
+        be cut so those links are written as the title and counted as dropped.
+        """
+        if budget.remaining > 0:
+            budget.remaining -= 1
+            return worksheet.write_url(row, col, url=link.url, string=link.title)
+
+        title = link.title or link.url
+        if budget.overflow == 'formula':
+            if len(link.url) <= FORMULA_STRING_LIMIT:
+                title = title[:FORMULA_STRING_LIMIT]
+                url = link.url.replace('"', '""')
+                text = title.replace('"', '""')
+                return worksheet.write_formula(row, col, f'=HYPERLINK("{url}","{text}")',
+                                               budget.url_format, title)
+            budget.dropped += 1
+        return worksheet.write_string(row, col, title)
 
     @staticmethod
     def write_local_datetime(worksheet, row, col, ts, _):
@@ -3,12 +3,47 @@
    If creating the Views DataFrame is succesful, it then calls Watch
    History Data to create the other DataFrames (Videos, Channels).
    Finally, if all the data was created properly, it will call the 
-   Spreadsheet Renderer (currently only whexcel) to create the spreadsheet."""
+   Spreadsheet Renderer (currently only whexcel) to create the spreadsheet.
+   With a memory limit, the views are processed out-of-core in chunks."""
 #core
+import argparse
+from json import JSONDecodeError
 import logging as log
+import math
 from pathlib import Path, PurePath
+from tempfile import TemporaryDirectory
 #modules
-from pandas import DataFrame
+from pandas import DataFrame, read_pickle
+#classes
+from classes.whdata import SESSION_IDLE_GAP, VIDEO_COLUMNS
+
+#bytes per view in flight when processing out-of-core: the parsed record, its row
+#in the chunk DataFrame, its spill and its Views sheet row (about 600 measured)
+VIEW_MEMORY = 2048
+
+
+def positive_int(value):
+    """argparse type for whole numbers greater than 0"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not greater than 0")
+    return number
+
+
+def positive_float(value):
+    """argparse type for numbers greater than 0"""
+    number = float(value)
+    if math.isnan(number) or number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not greater than 0")
+    return number
+
+
+def non_negative_float(value):
+    """argparse type for numbers of 0 or more"""
+    number = float(value)
+    if math.isnan(number) or number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is less than 0")
+    return number
 
 
 class WatchHistoryRun():
@@ -16,11 +51,23 @@ class WatchHistoryRun():
     whdf = None
     spreadsheet = None
 
-    def __init__(self, log_handler=None, data_handler=None, spreadsheet=None):
+    def __init__(self, log_handler=None, data_handler=None, spreadsheet=None,
+                 session_gap=SESSION_IDLE_GAP, memory_limit=None):
         if log_handler is not None:
             log.getLogger().addHandler(log_handler)
         self.whdf = data_handler
         self.ss = spreadsheet
+        self.session_gap = session_gap
+        #MB for the views in flight and the hyperlinks, when set the views
+        #are processed out-of-core
+        self.memory_limit = memory_limit
+        self.chunk_size = None
+        if memory_limit is not None:
+            #half of the limit for the views in flight, half for the spreadsheet's hyperlinks
+            half_limit = memory_limit * 2**20 // 2
+            self.chunk_size = max(1, half_limit // VIEW_MEMORY)
+            if spreadsheet is not None:
+                spreadsheet.limit_link_memory(half_limit)
 
     @staticmethod
     def get_source_path(source_file):
@@ -55,39 +102,132 @@ class WatchHistoryRun():
         return is_good
 
     def run(self, source_file, dest_file):
-        """run"""
-        views_df = None
-        channels_df = None
-        videos_df = None
-        monthlyviews_df = None
+        """run: returns True when the spreadsheet was exported"""
+        exported = False
         src = self.get_source_path(source_file)
         is_good_dest = self.is_good_path(dest_file)
         if src is not None and is_good_dest:
             log.info("Found '%s'", src.name)
-            wh = self.whdf
-            #views
-            views_df = wh.create_views_df_from_source(src)
-            if views_df is not None:
-                #videos
+            if self.chunk_size is None:
+                exported = self.run_in_memory(src, dest_file)
+            else:
+                exported = self.run_out_of_core(src, dest_file)
+        return exported
+
+    def run_in_memory(self, src, dest_file):
+        """Create all of the DataFrames from the full Views DataFrame."""
+        dataframes = None
+        wh = self.whdf
+        #views
+        views_df = wh.create_views_df_from_source(src)
+        if views_df is not None:
+            #videos
+            log.info('Creating video records')
+            videos_df = wh.create_videos_df(views_df)
+            channels_df = self.create_channels_df(videos_df, views_df.shape[0])
+            #daily, weekly, monthly and heatmap views
+            log.info('Creating view rollups')
+            rollups = wh.create_rollup_dfs(views_df)
+            #sessions
+            sessions_df = self.create_sessions_df(wh.create_session_views(views_df))
+            dataframes = {
+                'views_df': views_df,
+                'videos_df': videos_df,
+                'channels_df': channels_df,
+                'monthlyviews_df': rollups['monthly_df'],
+                'daily_df': rollups['daily_df'],
+                'weekly_df': rollups['weekly_df'],
+                'heatmap_df': rollups['heatmap_df'],
+                'sessions_df': sessions_df
+            }
+        return self.export(dest_file, dataframes)
+
+    def run_out_of_core(self, src, dest_file):
+        """
+        Create the DataFrames one chunk of chunk_size views at a time.
+        Each chunk is counted into ViewCounts
+        that are merged as they come in, and the chunk's views spill to a
+        temporary file so the Views sheet can be written later.
+        """
+        dataframes = None
+        wh = self.whdf
+        log.info('Processing %d views at a time (%s MB memory limit)',
+                 self.chunk_size, self.memory_limit)
+        with TemporaryDirectory(prefix='watch-history-') as spill_dir:
+            counts, spill_files = self.spill_chunks(src, spill_dir)
+            if counts is not None:
                 log.info('Creating video records')
-                videos_df = wh.create_videos_df(views_df)
-                log.info('%7d total videos', videos_df.shape[0])
-                log.info('%7d views of already watched videos',
-                         views_df.shape[0] - videos_df.shape[0])
-                log.info('Creating channel records')
-                #channels
-                channels_df = wh.create_channels_df(videos_df)
-                log.info('%7d channels', channels_df.shape[0])
-                #monthlyviews
-                monthlyviews_df = wh.create_monthlyviews_df(views_df)
-            if isinstance(channels_df, DataFrame) and self.ss is not None:
+                videos_df = wh.create_videos_df_from_counts(counts)
+                channels_df = self.create_channels_df(videos_df, counts.views)
+                log.info('Creating view rollups')
+                rollups = wh.create_rollup_dfs_from_counts(counts)
                 dataframes = {
-                    'views_df': views_df,
+                    'views_chunks': (read_pickle(spill_file) for spill_file in spill_files),
+                    'views_count': counts.views,
                     'videos_df': videos_df,
                     'channels_df': channels_df,
-                    'monthlyviews_df': monthlyviews_df
+                    'monthlyviews_df': rollups['monthly_df'],
+                    'daily_df': rollups['daily_df'],
+                    'weekly_df': rollups['weekly_df'],
+                    'heatmap_df': rollups['heatmap_df'],
+                    'sessions_df': self.create_sessions_df(counts.sessions)
                 }
-                self.ss.export_spreadsheet(dest_file, dataframes)
-            else:
-                log.info("No Watched History data to work with.")
-                log.info("Done.")
+            #export before the spill files are cleaned up
+            exported = self.export(dest_file, dataframes)
+        return exported
+
+    def spill_chunks(self, src, spill_dir):
+        """
+        Count every chunk of views into merged ViewCounts and spill the
+        chunk's views to a file in spill_dir, only the columns the Views sheet
+        is made from. Returns the ViewCounts (None when there are no views)
+        and the spill files in order.
+        """
+        counts = None
+        spill_files = []
+        views_columns = VIDEO_COLUMNS + ['view']
+        if self.ss is not None:
+            views_columns = self.ss.get_views_columns()
+        try:
+            for views_df in self.whdf.iter_views_dfs_from_source(src, self.chunk_size):
+                chunk_counts = self.whdf.create_view_counts(views_df)
+                counts = chunk_counts if counts is None else counts.merge(chunk_counts)
+                spill_file = Path(spill_dir, f'views-{len(spill_files):05d}.pkl')
+                DataFrame(views_df, columns=views_columns).to_pickle(spill_file)
+                spill_files.append(spill_file)
+        except JSONDecodeError as jerr:
+            log.error("JSON %s", jerr.msg)
+            counts = None
+        return counts, spill_files
+
+    def create_sessions_df(self, session_views):
+        """Create the Sessions DataFrame from the SessionViews, then log the sessions."""
+        log.info('Creating session records')
+        sessions_df = self.whdf.create_sessions_df_from_views(session_views, self.session_gap)
+        log.info('%7d sessions (%s minute idle gap)', sessions_df.shape[0], self.session_gap)
+        #single view sessions have no length, leave them out of the median
+        multi_view = sessions_df.loc[sessions_df['views'] > 1, 'minutes']
+        log.info('%7d sessions with more than one view, %.1f minutes median length',
+                 multi_view.shape[0], multi_view.median() if multi_view.shape[0] > 0 else 0)
+        log.info('%7d views in the longest binge', sessions_df['views'].max())
+        return sessions_df
+
+    def create_channels_df(self, videos_df, view_count):
+        """Log the video counts, then create the Channels DataFrame."""
+        log.info('%7d total videos', videos_df.shape[0])
+        log.info('%7d views of already watched videos', view_count - videos_df.shape[0])
+        log.info('Creating channel records')
+        channels_df = self.whdf.create_channels_df(videos_df)
+        log.info('%7d channels', channels_df.shape[0])
+        return channels_df
+
+    def export(self, dest_file, dataframes):
+        """Export the DataFrames to the spreadsheet, if there are any."""
+        exported = False
+        if dataframes is not None and self.ss is not None:
+            self.ss.export_spreadsheet(dest_file, dataframes)
+            exported = True
+        else:
+            log.info("No Watched History data to work with.")
+            log.info("Done.")
+        return exported
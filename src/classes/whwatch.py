@@ -0,0 +1,268 @@
+"""Watch History Watcher:
+   Watches a drop folder for Google Takeout files (zip, json, html) and
+   turns each new one into a spreadsheet with Watch History Run.
+   Files are only picked up once they stop changing (still being copied
+   files are left alone), and files with content that was already seen
+   are skipped. Every file gets a line in a JSON status log in the output
+   folder, which is also how processed files are remembered between runs.
+   The files are processed by a pool of worker processes, so there is no
+   startup cost per file and only a limited number run at the same time.
+   The workers are started fresh (forkserver or spawn, never a fork of the
+   threaded watcher) and send their log records back to the watcher."""
+#core
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import hashlib
+import json
+from json import JSONDecodeError
+import logging as log
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+import os
+from pathlib import Path, PurePath
+import time
+#classes
+from classes.whdata import WatchHistoryDataHandler, SESSION_IDLE_GAP
+from classes.whexcel import ExcelBuilder
+from classes.whrun import WatchHistoryRun
+
+SOURCE_SUFFIXES = ('.zip', '.json', '.html')
+STATUS_LOG = 'watch-history-status.jsonl'
+
+
+@dataclass
+class WatchSettings:
+    """How the watcher processes files, see watch_history_watcher.py for the details."""
+    workers: int = 2
+    #seconds a file has to stay unchanged before it is processed
+    settle: float = 5.0
+    #seconds between scans of the drop folder
+    interval: float = 2.0
+    session_gap: float = SESSION_IDLE_GAP
+    memory_limit: int = None
+
+
+@dataclass
+class PendingFile:
+    """A file in the drop folder that has not stopped changing yet."""
+    size: int
+    mtime: float
+    stable_since: float
+
+
+def init_worker(log_queue, log_level):
+    """Worker process setup: send the log records to the watcher through the log queue."""
+    root = log.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(log_level)
+
+
+def process_takeout(source_file, dest_file, session_gap, memory_limit):
+    """
+    Process one Google Takeout file, this runs in a worker process.
+    Returns True when the spreadsheet was exported.
+    """
+    watch_history = WatchHistoryRun(None, WatchHistoryDataHandler(), spreadsheet=ExcelBuilder(),
+                                    session_gap=session_gap, memory_limit=memory_limit)
+    return watch_history.run(source_file, dest_file)
+
+
+#the folders, the state of their files and the worker pool with its log queue
+class WatchHistoryWatcher:  # pylint: disable=too-many-instance-attributes
+    """WatchHistoryWatcher"""
+
+    def __init__(self, watch_dir, out_dir, settings=None):
+        self.watch_dir = Path(watch_dir).expanduser()
+        self.out_dir = Path(out_dir).expanduser()
+        self.settings = settings or WatchSettings()
+        self.status_log = Path(self.out_dir, STATUS_LOG)
+        self.pending = {}
+        self.executor = None
+        self.log_queue = None
+        #content hashes of files being processed right now
+        self.in_flight = set()
+        self.seen, self.handled = self.load_status()
+
+    def load_status(self):
+        """
+        Load the status log: the content hashes of files that were processed
+        ('done'), and the files (with their size and mtime) that do not need
+        to be looked at again ('done' or 'duplicate'). Failed files are
+        tried again.
+        """
+        seen = set()
+        handled = {}
+        if self.status_log.exists():
+            with open(self.status_log, 'r', encoding='UTF-8') as status_log:
+                for line in status_log:
+                    try:
+                        record = json.loads(line)
+                        status = record['status']
+                        if status == 'done':
+                            seen.add(record['sha256'])
+                        if status in ('done', 'duplicate') and 'size' in record:
+                            handled[Path(self.watch_dir, record['file'])] = (record['size'],
+                                                                            record['mtime'])
+                    except (JSONDecodeError, KeyError, TypeError):
+                        log.warning("Skipping bad status log line: %s", line.strip())
+        return seen, handled
+
+    def write_status(self, src, digest, status, dest_file=None):
+        """Append a line to the status log."""
+        size, mtime = self.handled.get(src, (None, None))
+        record = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'file': src.name,
+            'size': size,
+            'mtime': mtime,
+            'sha256': digest,
+            'status': status,
+            'output': None if dest_file is None else str(dest_file)
+        }
+        with open(self.status_log, 'a', encoding='UTF-8') as status_log:
+            status_log.write(json.dumps(record) + '\n')
+
+    def scan(self):
+        """
+        Scan the drop folder, returns the files that are ready to process:
+        new or changed since they were last handled, and unchanged for
+        at least settle seconds. Files that can not be read right now
+        (moved away, share dropped) are left for a later scan.
+        """
+        ready = []
+        now = time.monotonic()
+        try:
+            with os.scandir(self.watch_dir) as entries:
+                for entry in entries:
+                    src = Path(entry.path)
+                    try:
+                        if not entry.is_file() or src.suffix.lower() not in SOURCE_SUFFIXES:
+                            continue
+                        stat = entry.stat()
+                    except OSError as err:
+                        log.warning("Unable to check '%s': %s", src.name, err)
+                        continue
+                    signature = (stat.st_size, stat.st_mtime)
+                    if self.handled.get(src) == signature:
+                        continue
+                    pending = self.pending.get(src)
+                    if pending is None or (pending.size, pending.mtime) != signature:
+                        #new file, or still being written
+                        self.pending[src] = PendingFile(stat.st_size, stat.st_mtime, now)
+                    elif now - pending.stable_since >= self.settings.settle:
+                        del self.pending[src]
+                        self.handled[src] = signature
+                        ready.append(src)
+        except OSError as err:
+            log.warning("Unable to scan '%s': %s", self.watch_dir, err)
+        return ready
+
+    @staticmethod
+    def hash_file(src):
+        """SHA-256 of the file content."""
+        with open(src, 'rb') as doc:
+            return hashlib.file_digest(doc, 'sha256').hexdigest()
+
+    def output_file(self, src, digest):
+        """
+        The spreadsheet for a file, named after the file, its type and its
+        content, so different files never write to the same spreadsheet.
+        """
+        return PurePath(self.out_dir, f'{src.stem}-{src.suffix[1:].lower()}-{digest[:8]}.xlsx')
+
+    def create_executor(self):
+        """
+        Create the worker pool. The workers are started with forkserver where
+        it exists (spawn elsewhere), forking the watcher could copy a lock held
+        by one of its threads.
+        """
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if self.log_queue is None:
+            self.log_queue = context.Queue()
+        return ProcessPoolExecutor(max_workers=self.settings.workers, mp_context=context,
+                                   initializer=init_worker,
+                                   initargs=(self.log_queue, log.getLogger().getEffectiveLevel()))
+
+    async def run(self):
+        """Watch the drop folder until cancelled."""
+        log.info("Watching '%s' with %d workers", self.watch_dir, self.settings.workers)
+        queue = asyncio.Queue()
+        self.executor = self.create_executor()
+        #hand the workers' log records to the watcher's handlers
+        listener = QueueListener(self.log_queue, *log.getLogger().handlers)
+        listener.start()
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.settings.workers)]
+        try:
+            while True:
+                for src in self.scan():
+                    await queue.put(src)
+                await asyncio.sleep(self.settings.interval)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(cancel_futures=True)
+            listener.stop()
+
+    async def worker(self, queue):
+        """Process queued files one at a time."""
+        while True:
+            src = await queue.get()
+            try:
+                await self.process(src)
+            finally:
+                queue.task_done()
+
+    async def process(self, src):
+        """Process a file in the worker pool, unless its content was already seen."""
+        try:
+            digest = await asyncio.to_thread(self.hash_file, src)
+        except OSError as err:
+            log.error("Unable to read '%s': %s", src.name, err)
+            return
+        if digest in self.seen or digest in self.in_flight:
+            log.info("Skipping '%s', already processed", src.name)
+            self.write_status(src, digest, 'duplicate')
+            return
+
+        self.in_flight.add(digest)
+        dest_file = self.output_file(src, digest)
+        log.info("Processing '%s'", src.name)
+        try:
+            exported = await self.run_in_pool(src, dest_file)
+        finally:
+            self.in_flight.discard(digest)
+        if exported:
+            log.info("Done with '%s'", src.name)
+            self.seen.add(digest)
+            self.write_status(src, digest, 'done', dest_file)
+        else:
+            self.write_status(src, digest, 'failed')
+
+    async def run_in_pool(self, src, dest_file):
+        """
+        Run process_takeout in the worker pool. When a worker process dies
+        (out of memory, killed) the pool is broken for every file in it, so
+        it is replaced and the file is tried once more in the new pool.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(
+                    executor, process_takeout, src, dest_file,
+                    self.settings.session_gap, self.settings.memory_limit)
+            except BrokenProcessPool as err:
+                log.error("Worker process died while processing '%s': %s", src.name, err)
+                if self.executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = self.create_executor()
+                if attempt == 0:
+                    log.info("Trying '%s' again", src.name)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                log.error("Processing '%s' failed: %s", src.name, err)
+                break
+        return False
@@ -8,9 +8,9 @@ import sys
 from pathlib import Path, PurePath
 #classes
 # pylint: disable=no-name-in-module, import-error
-from classes.whrun import WatchHistoryRun
-from classes.whdata import WatchHistoryDataHandler as whdh
-from classes.whexcel import ExcelBuilder as excel
+from classes.whrun import WatchHistoryRun, positive_float, positive_int
+from classes.whdata import WatchHistoryDataHandler as whdh, SESSION_IDLE_GAP
+from classes.whexcel import ExcelBuilder as excel, HYPERLINK_LIMIT, LINK_OVERFLOWS
 
 
 def get_parameters():
@@ -25,7 +25,7 @@ def get_parameters():
     source = args.source_file or get_from_user(source_prompt, src_default)
     output_dir_prompt = "Enter Output directory"
     out_dir = args.output_dir or get_from_user(output_dir_prompt, "~/Downloads")
-    return source, out_dir
+    return source, out_dir, args
 
 
 def get_args():
@@ -37,6 +37,23 @@ def get_args():
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument("source_file", nargs="?", help="Google Takeout file")
     parser.add_argument("output_dir", nargs="?", help="Output directory")
+    parser.add_argument("--session-gap", type=positive_float, default=SESSION_IDLE_GAP,
+                        help="Minutes without a view that end a viewing session "
+                             f"(default: {SESSION_IDLE_GAP})")
+    parser.add_argument("--memory-limit", type=positive_int, metavar="MB",
+                        help="Process the watch history out-of-core in this many MB, "
+                             "half for the views being worked on and half for hyperlinks. "
+                             "The distinct videos and channels and 16 bytes per view "
+                             "(for sessions) come on top of that")
+    parser.add_argument("--link-budget", type=positive_int, default=HYPERLINK_LIMIT,
+                        help="Hyperlinks per sheet before switching to --link-overflow "
+                             f"(default and Excel's limit: {HYPERLINK_LIMIT})")
+    parser.add_argument("--link-overflow", choices=LINK_OVERFLOWS, default=LINK_OVERFLOWS[0],
+                        help="Write links over the budget as plain text with a url column, "
+                             f"or as HYPERLINK() formulas (default: {LINK_OVERFLOWS[0]})")
+    parser.add_argument("--compact", action="store_true",
+                        help="Smaller spreadsheet: the Views sheet lists Videos row keys "
+                             "instead of repeating video titles and links")
     args = parser.parse_args()
     return args
 
@@ -56,8 +73,12 @@ def main():
     log_handler = log.StreamHandler(sys.stdout)
     log_fmt = '%(asctime)s %(levelname)s\t%(message)s'
     log.basicConfig(level=log.INFO, format=log_fmt, handlers=[log_handler])
-    source, out_dir = get_parameters()
-    watch_history = WatchHistoryRun(None, whdh(), spreadsheet=excel())
+    source, out_dir, args = get_parameters()
+    spreadsheet = excel(link_overflow=args.link_overflow, link_budget=args.link_budget,
+                        compact=args.compact)
+    watch_history = WatchHistoryRun(None, whdh(), spreadsheet=spreadsheet,
+                                    session_gap=args.session_gap,
+                                    memory_limit=args.memory_limit)
     src = watch_history.get_source_path(source)
     if src is not None:
         xlsx_file = src.name.replace(src.suffix, '.xlsx')
@@ -0,0 +1,66 @@
+"""Drop folder version of watch-history. Watch a folder for Google Takeout
+    files that contain YouTube Watch History (zip, JSON or HTML files) and
+    output a spreadsheet for each new one, until stopped with Ctrl+C."""
+#core
+import argparse
+import asyncio
+import logging as log
+from pathlib import Path
+import sys
+#classes
+# pylint: disable=no-name-in-module, import-error
+from classes.whdata import SESSION_IDLE_GAP
+from classes.whrun import WatchHistoryRun, non_negative_float, positive_float, positive_int
+from classes.whwatch import WatchHistoryWatcher, WatchSettings
+
+
+def get_args():
+    """
+    Get the drop folder, output directory and watcher settings from
+    command line arguments
+    """
+    desc = "Watch a folder for Google Takeout files and output spreadsheets to a directory."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("watch_dir", help="Folder to watch for Google Takeout files")
+    parser.add_argument("output_dir", help="Output directory")
+    parser.add_argument("--workers", type=positive_int, default=2,
+                        help="Files processed at the same time (default: 2)")
+    parser.add_argument("--settle", type=non_negative_float, default=5.0,
+                        help="Seconds a file has to stop changing before it is processed "
+                             "(default: 5)")
+    parser.add_argument("--interval", type=positive_float, default=2.0,
+                        help="Seconds between checks of the folder (default: 2)")
+    parser.add_argument("--session-gap", type=positive_float, default=SESSION_IDLE_GAP,
+                        help="Minutes without a view that end a viewing session "
+                             f"(default: {SESSION_IDLE_GAP})")
+    parser.add_argument("--memory-limit", type=positive_int, metavar="MB",
+                        help="Process each watch history out-of-core in this many MB, "
+                             "half for the views being worked on and half for hyperlinks. "
+                             "The distinct videos and channels and 16 bytes per view "
+                             "(for sessions) come on top of that")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """main"""
+    log_handler = log.StreamHandler(sys.stdout)
+    log_fmt = '%(asctime)s %(levelname)s\t%(message)s'
+    log.basicConfig(level=log.INFO, format=log_fmt, handlers=[log_handler])
+    args = get_args()
+    if not Path(args.watch_dir).expanduser().is_dir():
+        log.error("Unable to find the folder '%s'", args.watch_dir)
+    elif not WatchHistoryRun.is_good_path(f"{args.output_dir}/"):
+        log.info("Nothing to do.")
+    else:
+        settings = WatchSettings(args.workers, args.settle, args.interval,
+                                 args.session_gap, args.memory_limit)
+        watcher = WatchHistoryWatcher(args.watch_dir, args.output_dir, settings)
+        try:
+            asyncio.run(watcher.run())
+        except KeyboardInterrupt:
+            log.info("Stopped watching.")
+
+
+if __name__ == '__main__':
+    main()